@@ -4,6 +4,7 @@ import random
 import time
 from dataclasses import dataclass
 
+import cv2
 import gymnasium as gym
 import numpy as np
 import torch
@@ -13,10 +14,8 @@ import torch.nn.utils.prune as prune
 import torch.optim as optim
 import tyro
 from stable_baselines3.common.atari_wrappers import (
-    ClipRewardEnv,
     EpisodicLifeEnv,
     FireResetEnv,
-    MaxAndSkipEnv,
     NoopResetEnv,
 )
 from stable_baselines3.common.buffers import ReplayBuffer
@@ -39,6 +38,8 @@ class Args:
     """if toggled, will prune the model for three times"""
     prune_method: str = "l1"
     """chooses between l1 vs random"""
+    compile: bool = False
+    """if toggled, the Q-networks will be compiled with `torch.compile` for their fixed batch shapes (torch>=2.0)"""
     track: bool = False
     """if toggled, this experiment will be tracked with Weights and Biases"""
     wandb_project_name: str = "cleanRL"
@@ -85,6 +86,105 @@ class Args:
     """the frequency of training"""
 
 
+class MaxAndSkipEnv(gym.Wrapper):
+    """
+    Return only every `skip`-th frame, max-pooled over the last two observations.
+
+    The max is taken with `np.maximum` into a preallocated output buffer instead of `.max(axis=0)`,
+    which avoids an allocation and the generic reduction machinery on every step. Frames go into a
+    2-slot ring with no per-iteration branches. The returned array is reused across steps.
+    """
+
+    def __init__(self, env: gym.Env, skip: int = 4):
+        super().__init__(env)
+        self._obs_buffer = np.zeros((2,) + env.observation_space.shape, dtype=env.observation_space.dtype)
+        self._max_frame = np.empty(env.observation_space.shape, dtype=env.observation_space.dtype)
+        self._skip = skip
+
+    def step(self, action):
+        total_reward = 0.0
+        terminated = truncated = False
+        for i in range(self._skip):
+            obs, reward, terminated, truncated, info = self.env.step(action)
+            # 2-slot ring: after the loop the slots hold the last two frames, in some order
+            self._obs_buffer[i & 1] = obs
+            total_reward += float(reward)
+            if terminated or truncated:
+                break
+        np.maximum(self._obs_buffer[0], self._obs_buffer[1], out=self._max_frame)
+        return self._max_frame, total_reward, terminated, truncated, info
+
+
+class ClipRewardEnv(gym.RewardWrapper):
+    """
+    Clip the reward to {+1, 0, -1} by its sign.
+
+    Plain comparisons avoid dispatching the `np.sign` ufunc on a Python scalar every step.
+    """
+
+    def reward(self, reward):
+        reward = float(reward)
+        return float((reward > 0) - (reward < 0))
+
+
+class WarpFrame(gym.ObservationWrapper):
+    """
+    Convert frames to grayscale and resize them to `height` x `width` in a single wrapper.
+
+    Both steps write into buffers allocated once, so no intermediate frame is created per step.
+    The returned array is reused across steps.
+    """
+
+    def __init__(self, env: gym.Env, width: int = 84, height: int = 84):
+        super().__init__(env)
+        self._width = width
+        self._height = height
+        self.observation_space = gym.spaces.Box(low=0, high=255, shape=(height, width), dtype=np.uint8)
+        self._gray = np.empty(env.observation_space.shape[:2], dtype=np.uint8)
+        self._frame = np.empty((height, width), dtype=np.uint8)
+
+    def observation(self, frame):
+        # OpenCV writes into `dst` when it matches and allocates otherwise, so always keep what it returns
+        self._gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY, dst=self._gray)
+        self._frame = cv2.resize(self._gray, (self._width, self._height), dst=self._frame, interpolation=cv2.INTER_AREA)
+        return self._frame
+
+
+class FrameStack(gym.Wrapper):
+    """
+    Stack the last `num_stack` frames into a `(num_stack, *frame_shape)` observation.
+
+    Frames are kept in a mirrored ring buffer of length `2 * num_stack`: each new frame is written to
+    slot `head` and `head + num_stack`, so the latest `num_stack` frames are always one contiguous slice
+    and no per-step concatenation is needed. The returned array is a view that is only valid until the
+    next `step`, callers that keep it must copy it (`SyncVectorEnv` and the replay buffer both do).
+    """
+
+    def __init__(self, env: gym.Env, num_stack: int):
+        super().__init__(env)
+        self.num_stack = num_stack
+        low = np.repeat(env.observation_space.low[np.newaxis, ...], num_stack, axis=0)
+        high = np.repeat(env.observation_space.high[np.newaxis, ...], num_stack, axis=0)
+        self.observation_space = gym.spaces.Box(low=low, high=high, dtype=env.observation_space.dtype)
+        self._frames = np.empty((2 * num_stack,) + env.observation_space.shape, dtype=env.observation_space.dtype)
+        self._head = 0
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        self._frames[self._head] = obs
+        self._frames[self._head + self.num_stack] = obs
+        self._head = (self._head + 1) % self.num_stack
+        return self._frames[self._head : self._head + self.num_stack], reward, terminated, truncated, info
+
+    def reset(self, **kwargs):
+        obs, info = self.env.reset(**kwargs)
+        # a fresh buffer keeps observations handed out before the reset (e.g. `final_observation`) intact
+        self._frames = np.empty_like(self._frames)
+        self._frames[:] = obs
+        self._head = 0
+        return self._frames[: self.num_stack], info
+
+
 def make_env(env_id, seed, idx, capture_video, run_name):
     def thunk():
         if capture_video and idx == 0:
@@ -100,9 +200,8 @@ def make_env(env_id, seed, idx, capture_video, run_name):
         if "FIRE" in env.unwrapped.get_action_meanings():
             env = FireResetEnv(env)
         env = ClipRewardEnv(env)
-        env = gym.wrappers.ResizeObservation(env, (84, 84))
-        env = gym.wrappers.GrayScaleObservation(env)
-        env = gym.wrappers.FrameStack(env, 4)
+        env = WarpFrame(env, width=84, height=84)
+        env = FrameStack(env, 4)
 
         env.action_space.seed(seed)
         return env
@@ -110,6 +209,20 @@ def make_env(env_id, seed, idx, capture_video, run_name):
     return thunk
 
 
+class PinnedReplayBuffer(ReplayBuffer):
+    """
+    `ReplayBuffer` that stages sampled batches in page-locked host memory.
+
+    Copies out of pinned memory can be issued with `non_blocking=True`, so the transfer of a batch
+    overlaps with GPU work that is still queued instead of stalling on a pageable copy.
+    """
+
+    def to_torch(self, array: np.ndarray, copy: bool = True) -> torch.Tensor:
+        if self.device.type != "cuda":
+            return super().to_torch(array, copy)
+        return torch.from_numpy(array).pin_memory().to(self.device, non_blocking=True)
+
+
 # ALGO LOGIC: initialize agent here:
 class QNetwork(nn.Module):
     def __init__(self, env):
@@ -128,13 +241,10 @@ class QNetwork(nn.Module):
         )
 
     def forward(self, x):
+        # frames arrive as uint8; scaling on the model's device keeps host->device transfers 4x smaller
         return self.network(x / 255.0)
 
 
-def linear_schedule(start_e: float, end_e: float, duration: int, t: int):
-    slope = (end_e - start_e) / duration
-    return max(slope * t + start_e, end_e)
-
 def save_efficiently(name: str, suffix: str, model: nn.Module):
     sparse_weights = {}
     for idx, module in enumerate(model.network):
@@ -180,7 +290,9 @@ poetry run pip install "stable_baselines3==2.0.0a1" "gymnasium[atari,accept-rom-
 """
         )
     args = tyro.cli(Args)
-    assert args.num_envs == 1, "vectorized envs are not supported at the moment"
+    assert args.num_envs <= args.train_frequency, "`num_envs` must not exceed `train_frequency`, or the replay ratio drops"
+    assert not (args.compile and args.prune), "pruning hooks are not supported on compiled networks"
+    assert not args.compile or hasattr(torch, "compile"), "--compile requires torch>=2.0"
     run_name = f"{args.env_id}__{args.exp_name}__{args.seed}__{int(time.time())}"
     if args.track:
         import wandb
@@ -213,17 +325,25 @@ poetry run pip install "stable_baselines3==2.0.0a1" "gymnasium[atari,accept-rom-
         [make_env(args.env_id, args.seed + i, i, args.capture_video, run_name) for i in range(args.num_envs)]
     )
     assert isinstance(envs.single_action_space, gym.spaces.Discrete), "only discrete action space is supported"
+    # the replay buffer stores frames in the observation space's dtype; scaling happens on device in `QNetwork`
+    assert envs.single_observation_space.dtype == np.uint8, "frames must stay uint8 for the replay buffer"
 
     q_network = QNetwork(envs).to(device)
     optimizer = optim.Adam(q_network.parameters(), lr=args.learning_rate)
     target_network = QNetwork(envs).to(device)
     target_network.load_state_dict(q_network.state_dict())
+    # compiled wrappers share parameters with the plain modules, which stay in use for updates and saving
+    q_network_fwd, target_network_fwd = q_network, target_network
+    if args.compile:
+        q_network_fwd = torch.compile(q_network, mode="reduce-overhead", dynamic=False)
+        target_network_fwd = torch.compile(target_network, mode="reduce-overhead", dynamic=False)
 
-    rb = ReplayBuffer(
+    rb = PinnedReplayBuffer(
         args.buffer_size,
         envs.single_observation_space,
         envs.single_action_space,
         device,
+        n_envs=args.num_envs,
         optimize_memory_usage=True,
         handle_timeout_termination=False,
     )
@@ -231,19 +351,28 @@ poetry run pip install "stable_baselines3==2.0.0a1" "gymnasium[atari,accept-rom-
 
     # TRY NOT TO MODIFY: start the game
     obs, _ = envs.reset(seed=args.seed)
-    for global_step in range(args.total_timesteps):
-        if args.prune and global_step != 0 and global_step % (args.total_timesteps // 2) == 0:
+    # linear epsilon schedule, with the slope computed once instead of on every step
+    epsilon_slope = (args.end_e - args.start_e) / (args.exploration_fraction * args.total_timesteps)
+    # `global_step` counts env steps, so each iteration advances it by `num_envs`; a periodic event with
+    # period `k` fires on the iteration whose window `[global_step, global_step + num_envs)` contains a multiple of `k`
+    for global_step in range(0, args.total_timesteps, args.num_envs):
+        if args.prune and global_step != 0 and global_step % (args.total_timesteps // 2) < args.num_envs:
             print('applying pruning...')
             apply_pruning('QNetwork', q_network, args.prune_amount)
             apply_pruning('TargetNetwork', target_network, args.prune_amount)
 
         # ALGO LOGIC: put action logic here
-        epsilon = linear_schedule(args.start_e, args.end_e, args.exploration_fraction * args.total_timesteps, global_step)
-        if random.random() < epsilon:
+        epsilon = max(epsilon_slope * global_step + args.start_e, args.end_e)
+        # explore per env, but run a single batched forward over all envs that act greedily
+        explore = np.array([random.random() < epsilon for _ in range(envs.num_envs)])
+        if explore.all():
             actions = np.array([envs.single_action_space.sample() for _ in range(envs.num_envs)])
         else:
-            q_values = q_network(torch.Tensor(obs).to(device))
-            actions = torch.argmax(q_values, dim=1).cpu().numpy()
+            with torch.inference_mode():
+                q_values = q_network_fwd(torch.from_numpy(obs).to(device))
+                actions = torch.argmax(q_values, dim=1).cpu().numpy()
+            for idx in np.flatnonzero(explore):
+                actions[idx] = envs.single_action_space.sample()
 
         # TRY NOT TO MODIFY: execute the game and log data.
         next_obs, rewards, terminations, truncations, infos = envs.step(actions)
@@ -257,10 +386,13 @@ poetry run pip install "stable_baselines3==2.0.0a1" "gymnasium[atari,accept-rom-
                     writer.add_scalar("charts/episodic_length", info["episode"]["l"], global_step)
 
         # TRY NOT TO MODIFY: save data to reply buffer; handle `final_observation`
-        real_next_obs = next_obs.copy()
-        for idx, trunc in enumerate(truncations):
-            if trunc:
-                real_next_obs[idx] = infos["final_observation"][idx]
+        # only materialize a separate stacked copy when a truncated env needs its final observation patched in
+        real_next_obs = next_obs
+        if truncations.any():
+            real_next_obs = next_obs.copy()
+            for idx, trunc in enumerate(truncations):
+                if trunc:
+                    real_next_obs[idx] = infos["final_observation"][idx]
         rb.add(obs, real_next_obs, actions, rewards, terminations, infos)
 
         # TRY NOT TO MODIFY: CRUCIAL step easy to overlook
@@ -268,18 +400,18 @@ poetry run pip install "stable_baselines3==2.0.0a1" "gymnasium[atari,accept-rom-
 
         # ALGO LOGIC: training.
         if global_step > args.learning_starts:
-            if global_step % args.train_frequency == 0:
+            if global_step % args.train_frequency < args.num_envs:
                 data = rb.sample(args.batch_size)
                 with torch.no_grad():
-                    target_max, _ = target_network(data.next_observations).max(dim=1)
-                    td_target = data.rewards.flatten() + args.gamma * target_max * (1 - data.dones.flatten())
-                old_val = q_network(data.observations).gather(1, data.actions).squeeze()
+                    # `amax` skips the unused argmax indices, `addcmul` folds the target arithmetic into one kernel
+                    target_max = target_network_fwd(data.next_observations).amax(dim=1)
+                    td_target = torch.addcmul(data.rewards.flatten(), target_max, 1 - data.dones.flatten(), value=args.gamma)
+                old_val = q_network_fwd(data.observations).gather(1, data.actions).squeeze()
                 loss = F.mse_loss(td_target, old_val)
 
-                if global_step % 100 == 0:
+                if global_step % 100 < args.num_envs:
                     writer.add_scalar("losses/td_loss", loss, global_step)
                     writer.add_scalar("losses/q_values", old_val.mean().item(), global_step)
-                    print("SPS:", int(global_step / (time.time() - start_time)))
                     writer.add_scalar("charts/SPS", int(global_step / (time.time() - start_time)), global_step)
 
                 # optimize the model
@@ -288,11 +420,10 @@ poetry run pip install "stable_baselines3==2.0.0a1" "gymnasium[atari,accept-rom-
                 optimizer.step()
 
             # update target network
-            if global_step % args.target_network_frequency == 0:
+            if global_step % args.target_network_frequency < args.num_envs:
                 for target_network_param, q_network_param in zip(target_network.parameters(), q_network.parameters()):
-                    target_network_param.data.copy_(
-                        args.tau * q_network_param.data + (1.0 - args.tau) * target_network_param.data
-                    )
+                    # in-place `(1 - tau) * target + tau * q`, exact copy for `tau == 1`, without temporaries
+                    target_network_param.data.lerp_(q_network_param.data, args.tau)
 
     if args.save_model:
         print('removing prune masks...')
@@ -1,5 +1,8 @@
 import subprocess
 
+import pytest
+import torch
+
 
 def test_dqn():
     subprocess.run(
@@ -9,6 +12,23 @@ def test_dqn():
     )
 
 
+def test_dqn_num_envs():
+    subprocess.run(
+        "python cleanrl/dqn_atari.py --num-envs 2 --learning-starts 10 --total-timesteps 16 --buffer-size 10 --batch-size 4",
+        shell=True,
+        check=True,
+    )
+
+
+@pytest.mark.skipif(not hasattr(torch, "compile"), reason="`torch.compile` requires torch>=2.0")
+def test_dqn_compile():
+    subprocess.run(
+        "python cleanrl/dqn_atari.py --compile --learning-starts 10 --total-timesteps 16 --buffer-size 10 --batch-size 4",
+        shell=True,
+        check=True,
+    )
+
+
 def test_dqn_eval():
     subprocess.run(
         "python cleanrl/dqn_atari.py --save-model --learning-starts 10 --total-timesteps 16 --buffer-size 10 --batch-size 4",
@@ -0,0 +1,81 @@
+import gymnasium as gym
+import numpy as np
+import stable_baselines3.common.atari_wrappers as sb3_atari_wrappers
+
+from cleanrl.dqn_atari import FrameStack, MaxAndSkipEnv
+
+
+class CounterEnv(gym.Env):
+    """Deterministic stub whose frames only depend on the number of steps since the last reset."""
+
+    observation_space = gym.spaces.Box(low=0, high=255, shape=(6, 5), dtype=np.uint8)
+    action_space = gym.spaces.Discrete(2)
+
+    def __init__(self, episode_length: int):
+        self.episode_length = episode_length
+        self.t = 0
+
+    def _frame(self):
+        return np.random.default_rng(self.t).integers(0, 256, size=self.observation_space.shape, dtype=np.uint8)
+
+    def reset(self, *, seed=None, options=None):
+        super().reset(seed=seed)
+        self.t = 0
+        return self._frame(), {}
+
+    def step(self, action):
+        self.t += 1
+        return self._frame(), float(self.t), self.t >= self.episode_length, False, {}
+
+
+def test_frame_stack_matches_gymnasium():
+    env = FrameStack(CounterEnv(episode_length=7), 4)
+    reference = gym.wrappers.FrameStack(CounterEnv(episode_length=7), 4)
+    assert env.observation_space == reference.observation_space
+
+    obs, _ = env.reset()
+    ref_obs, _ = reference.reset()
+    np.testing.assert_array_equal(obs, np.asarray(ref_obs))
+    for _ in range(20):
+        obs, _, terminated, _, _ = env.step(0)
+        ref_obs, _, ref_terminated, _, _ = reference.step(0)
+        assert terminated == ref_terminated
+        np.testing.assert_array_equal(obs, np.asarray(ref_obs))
+        if terminated:
+            # the view handed out as `final_observation` must survive the reset and the following steps
+            final_obs, ref_final_obs = obs, np.asarray(ref_obs)
+            obs, _ = env.reset()
+            ref_obs, _ = reference.reset()
+            np.testing.assert_array_equal(obs, np.asarray(ref_obs))
+            env.step(0)
+            reference.step(0)
+            np.testing.assert_array_equal(final_obs, ref_final_obs)
+
+
+def test_frame_stack_final_observation_in_vector_env():
+    envs = gym.vector.SyncVectorEnv([lambda: FrameStack(CounterEnv(episode_length=5), 4)])
+    reference = gym.vector.SyncVectorEnv([lambda: gym.wrappers.FrameStack(CounterEnv(episode_length=5), 4)])
+    envs.reset()
+    reference.reset()
+    for _ in range(12):
+        obs, _, terminations, _, infos = envs.step(np.array([0]))
+        ref_obs, _, _, _, ref_infos = reference.step(np.array([0]))
+        np.testing.assert_array_equal(obs, ref_obs)
+        if terminations[0]:
+            np.testing.assert_array_equal(infos["final_observation"][0], np.asarray(ref_infos["final_observation"][0]))
+
+
+def test_max_and_skip_matches_sb3():
+    # episodes last a whole number of skips, where both wrappers pool the same two frames
+    env = MaxAndSkipEnv(CounterEnv(episode_length=8), skip=4)
+    reference = sb3_atari_wrappers.MaxAndSkipEnv(CounterEnv(episode_length=8), skip=4)
+    env.reset()
+    reference.reset()
+    for _ in range(6):
+        obs, reward, terminated, truncated, _ = env.step(0)
+        ref_obs, ref_reward, ref_terminated, ref_truncated, _ = reference.step(0)
+        np.testing.assert_array_equal(obs, ref_obs)
+        assert (reward, terminated, truncated) == (ref_reward, ref_terminated, ref_truncated)
+        if terminated:
+            env.reset()
+            reference.reset()